@@ -8,6 +8,8 @@ class Settings(BaseSettings):
     # Supabase設定
     supabase_url: str = Field(..., env="SUPABASE_URL")
     supabase_key: str = Field(..., env="SUPABASE_KEY")
+    supabase_page_size: int = Field(default=1000, env="SUPABASE_PAGE_SIZE")
+    supabase_fetch_concurrency: int = Field(default=4, env="SUPABASE_FETCH_CONCURRENCY")
     
     # AWS設定
     aws_region_name: str = Field(default="us-east-1", env="AWS_REGION_NAME")
@@ -25,12 +27,26 @@ class Settings(BaseSettings):
     log_level: str = Field(default="WARNING", env="LOG_LEVEL")
     internal_api_secret: str = Field(..., env="INTERNAL_API_SECRET")
     
+    # レート制限設定(rateは1秒あたりの補充数, burstはバケットの最大数)
+    rate_limit_user_rate: float = Field(default=0.1, env="RATE_LIMIT_USER_RATE")
+    rate_limit_user_burst: float = Field(default=3, env="RATE_LIMIT_USER_BURST")
+    rate_limit_global_rate: float = Field(default=2.0, env="RATE_LIMIT_GLOBAL_RATE")
+    rate_limit_global_burst: float = Field(default=10, env="RATE_LIMIT_GLOBAL_BURST")
+    # 複数ワーカーで共有する場合はRedisのURLを指定する(空ならプロセス内で管理)
+    # ※ 同じリクエストの相乗りはプロセス内のみのため、別ワーカーに届いた重複リクエストはそれぞれ実行される
+    rate_limit_redis_url: str = Field(default="", env="RATE_LIMIT_REDIS_URL")
+    
     # FitDit設定
     fitdit_url: str = Field(..., env="FITDIT_URL")
     
     # モデル設定
     model_name: str = Field(default="patrickjohncyh/fashion-clip")
     
+    # 洋服カタログのスナップショット設定
+    catalog_updated_column: str = Field(default="updated_at", env="CATALOG_UPDATED_COLUMN")
+    catalog_refresh_interval: int = Field(default=300, env="CATALOG_REFRESH_INTERVAL")
+    catalog_full_refresh_every: int = Field(default=12, env="CATALOG_FULL_REFRESH_EVERY")
+    
     # デフォルト設定
     default_tops_id: int = Field(default=1)
     
@@ -40,6 +56,12 @@ class Settings(BaseSettings):
         """ローカルインデックスパスを計算"""
         return f"../tmp/{self.aws_faiss_index_name}"
     
+    @computed_field
+    @property
+    def local_catalog_path(self) -> str:
+        """ローカルの洋服カタログスナップショットのパス"""
+        return "../tmp/catalog_snapshot.npz"
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
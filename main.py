@@ -13,6 +13,8 @@ import torch
 
 from core.config import settings
 from middlewares.middleware import verify_secret_key
+from middlewares.rate_limit import limit_recommend_rate, recommend_coalescer
+from utils.catalog import catalog
 from utils.clipFaiss import (
     retrieve_similar_images_by_vector,
     load_faiss_index,
@@ -54,6 +56,7 @@ preprocess_train = None
 preprocess_val   = None
 tokenizer        = None
 index            = None
+catalog_task     = None
 
 @app.on_event("startup")
 async def startup_event():
@@ -63,7 +66,7 @@ async def startup_event():
     """
     try:
         start = time.time()
-        global model, preprocess_train, preprocess_val, tokenizer, index
+        global model, preprocess_train, preprocess_val, tokenizer, index, catalog_task
         
         logger.info("STARTUP: S3ダウンロード開始")
         download_if_needed(
@@ -92,12 +95,34 @@ async def startup_event():
             logger.error("faissのインデックスが見つかりません。終了します。")
         logger.info(f"STARTUP: {settings.local_index_path}のインデックスロード完了")
 
+        # 洋服カタログはスナップショットを読み込み、差分のみSupabaseから取得する
+        logger.info("STARTUP: カタログロード開始")
+        await asyncio.to_thread(catalog.load)
+        try:
+            await asyncio.to_thread(catalog.refresh)
+        except Exception as e:
+            # 取得に失敗しても終了せず、定期更新で再取得する(空の間はSupabaseから直接取得する)
+            logger.error(f"STARTUP: カタログの取得に失敗しました。定期更新で再取得します: {e}")
+        catalog_task = asyncio.create_task(refresh_catalog_periodically())
+        logger.info(f"STARTUP: カタログロード完了 - {len(catalog)}件")
+
         logger.info(f"STARTUP: 全体の初期化完了 - 処理時間: {time.time() - start:.2f}秒")
     except Exception as e:
         logger.error(f"STARTUP: エラーが発生しました: {e}")
         import sys
         sys.exit(1)
 
+async def refresh_catalog_periodically():
+    """
+    一定間隔で洋服カタログの差分を取得する
+    """
+    while True:
+        await asyncio.sleep(settings.catalog_refresh_interval)
+        try:
+            await asyncio.to_thread(catalog.refresh)
+        except Exception as e:
+            logger.warning(f"カタログの差分取得に失敗しました: {e}")
+
 #--------------------
 # test API
 #--------------------
@@ -121,10 +146,13 @@ class UserIdRequest(BaseModel):
 async def get_recommendation_clothes(
     request: UserIdRequest,
     # シークレットキーの検証(middleware.py)
-    _: None = Depends(verify_secret_key)
+    _: None = Depends(verify_secret_key),
+    # レート制限(rate_limit.py)
+    __: None = Depends(limit_recommend_rate)
 ):
     """
     リクエストからユーザの好みに合った洋服を推薦し、VTONの画像を生成する
+    同じユーザー・カテゴリのリクエストが実行中の場合はその結果を共有する
     args:
         request: UserIdRequest{
             user_id:          str
@@ -134,6 +162,15 @@ async def get_recommendation_clothes(
     returns:
         object_key: str
     """
+    return await recommend_coalescer.run(
+        (request.user_id, request.clothes_category),
+        lambda: recommend_clothes(request)
+    )
+
+async def recommend_clothes(request: UserIdRequest):
+    """
+    推薦とVTON生成の本体
+    """
     
     #########################################################
     # リクエストから好みベクトルを生成
@@ -161,8 +198,8 @@ async def get_recommendation_clothes(
     
     # 洋服カテゴリ別洋服ID取得
     try:
-        clothes_ids = db.get_clothes_ids_about_clothes_part(clothes_part=clothes_part)
-        if not clothes_ids:
+        clothes_ids = catalog.ids_by_clothes_part(clothes_part=clothes_part)
+        if len(clothes_ids) == 0:
             raise HTTPException(status_code=400, detail="指定されたカテゴリの洋服が見つかりません")
         faiss_selector = faiss.IDSelectorArray(clothes_ids)
     except Exception as e:
@@ -177,13 +214,13 @@ async def get_recommendation_clothes(
     # 性別によって洋服をフィルタリング
     try:
         if user.data[0]["gender"] == "man":
-            exclude_clothes_ids_about_gender = db.get_clothes_ids_about_gender(gender="woman")
-            if exclude_clothes_ids_about_gender:
+            exclude_clothes_ids_about_gender = catalog.ids_by_gender(gender="woman")
+            if len(exclude_clothes_ids_about_gender) > 0:
                 exclude_selector_by_gender = faiss.IDSelectorNot(faiss.IDSelectorArray(exclude_clothes_ids_about_gender))
                 faiss_selector             = faiss.IDSelectorAnd(faiss_selector, exclude_selector_by_gender)
         elif user.data[0]["gender"] == "woman":
-            exclude_clothes_ids_about_gender = db.get_clothes_ids_about_gender(gender="man")
-            if exclude_clothes_ids_about_gender:
+            exclude_clothes_ids_about_gender = catalog.ids_by_gender(gender="man")
+            if len(exclude_clothes_ids_about_gender) > 0:
                 exclude_selector_by_gender = faiss.IDSelectorNot(faiss.IDSelectorArray(exclude_clothes_ids_about_gender))
                 faiss_selector             = faiss.IDSelectorAnd(faiss_selector, exclude_selector_by_gender)
         else:
@@ -213,7 +250,13 @@ async def get_recommendation_clothes(
         raise HTTPException(status_code=500, detail="類似画像の検索に失敗しました")
 
     # 洋服情報を取得
-    clothes = db.get_clothes_by_id(similar_clothes_id)
+    # カタログの更新前に削除された洋服が候補に残っている場合は、他の候補を使う
+    candidate_ids = [similar_clothes_id] + [int(i) for i in similar_clothes_ids if i != similar_clothes_id and i >= 0]
+    for candidate_id in candidate_ids:
+        clothes = db.get_clothes_by_id(int(candidate_id))
+        if clothes.data:
+            break
+        logger.warning(f"洋服 {candidate_id} が見つからないため次の候補を使います")
     if not clothes.data:
         raise HTTPException(status_code=500, detail="洋服が見つかりません")
     clothes_key = clothes.data[0]["object_key"]
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Hashable
+
+from fastapi import HTTPException, Request, status
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryTokenBucketBackend:
+    """
+    プロセス内でトークンバケットを管理するバックエンド(単一ワーカー向け)
+    """
+
+    # 満タンに戻ったバケットを削除する間隔(秒)
+    EVICT_INTERVAL = 60
+
+    def __init__(self):
+        # key -> (残りトークン数, 最終更新時刻, rate, capacity)
+        self._buckets: dict[str, tuple[float, float, float, float]] = {}
+        self._lock = asyncio.Lock()
+        self._last_evicted = time.monotonic()
+
+    def _evict(self, now: float) -> None:
+        """満タンに戻ったバケットは初期状態と同じなので削除する"""
+        if now - self._last_evicted < self.EVICT_INTERVAL:
+            return
+        self._last_evicted = now
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket[0] + (now - bucket[1]) * bucket[2] < bucket[3]
+        }
+
+    async def acquire(self, key: str, rate: float, capacity: float) -> float:
+        """
+        トークンを1つ消費する
+        args:
+            key: str
+            rate: float (1秒あたりの補充数)
+            capacity: float (バケットの最大トークン数)
+        returns:
+            retry_after: float (0なら許可. それ以外は次のトークンまでの秒数)
+        """
+        async with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            tokens, last, _, _ = self._buckets.get(key, (capacity, now, rate, capacity))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now, rate, capacity)
+                return 0.0
+            self._buckets[key] = (tokens, now, rate, capacity)
+            return (1 - tokens) / rate
+
+    async def refund(self, key: str, capacity: float) -> None:
+        """消費したトークンを1つ戻す"""
+        async with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                tokens, last, rate, _ = bucket
+                self._buckets[key] = (min(capacity, tokens + 1), last, rate, capacity)
+
+
+# トークンの補充と消費をRedis上でアトミックに行うスクリプト
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - last) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(retry_after)
+"""
+
+_REDIS_REFUND_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(capacity, tokens + 1))
+end
+return 0
+"""
+
+
+class RedisTokenBucketBackend:
+    """
+    Redisでトークンバケットを管理するバックエンド(複数ワーカー向け)
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+        self._refund_script = self._client.register_script(_REDIS_REFUND_SCRIPT)
+
+    async def acquire(self, key: str, rate: float, capacity: float) -> float:
+        """MemoryTokenBucketBackend.acquireと同じ"""
+        retry_after = await self._script(keys=[f"rate_limit:{key}"], args=[rate, capacity])
+        return float(retry_after)
+
+    async def refund(self, key: str, capacity: float) -> None:
+        """MemoryTokenBucketBackend.refundと同じ"""
+        await self._refund_script(keys=[f"rate_limit:{key}"], args=[capacity])
+
+
+class RequestCoalescer:
+    """
+    同じキーで同時に実行中の処理を1つにまとめ、結果を共有する
+    ※ プロセス内でのみ共有するため、複数ワーカーではワーカーごとに実行される
+    """
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    def _on_done(self, key: Hashable, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        # 待っていたクライアントが全員切断した場合でも、例外を回収してログに残す
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"共有した処理でエラーが発生しました: {key}: {task.exception()}")
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable]):
+        """
+        同じキーの処理が実行中ならその結果を待ち、無ければfuncを実行する
+        args:
+            key: Hashable
+            func: Callable[[], Awaitable]
+        returns:
+            funcの結果
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            logger.info(f"実行中のリクエストに相乗りします: {key}")
+        # 1つのクライアントが切断しても、共有している処理はキャンセルしない
+        return await asyncio.shield(task)
+
+
+def create_rate_limit_backend():
+    """設定に応じてバックエンドを作成する"""
+    if settings.rate_limit_redis_url:
+        import redis.asyncio as redis
+
+        return RedisTokenBucketBackend(redis.from_url(settings.rate_limit_redis_url))
+    return MemoryTokenBucketBackend()
+
+
+rate_limit_backend = create_rate_limit_backend()
+recommend_coalescer = RequestCoalescer()
+
+
+def _too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def limit_recommend_rate(request: Request):
+    """
+    /recommend のユーザー別・全体のレート制限を行う依存関係
+    同じ(user_id, clothes_category)の処理が実行中の場合は相乗りするため制限しない
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        # ボディの検証はエンドポイント側に任せる
+        return
+    if not isinstance(body, dict):
+        return
+    user_id = body.get("user_id")
+    clothes_category = body.get("clothes_category")
+    # 型が不正な場合はエンドポイント側の検証(422)に任せる
+    if not isinstance(user_id, str) or not isinstance(clothes_category, str):
+        return
+    if recommend_coalescer.in_flight((user_id, clothes_category)):
+        return
+
+    user_key = f"user:{user_id}"
+    retry_after = await rate_limit_backend.acquire(
+        user_key,
+        settings.rate_limit_user_rate,
+        settings.rate_limit_user_burst,
+    )
+    if retry_after > 0:
+        logger.warning(f"ユーザー {user_id} のレート制限を超えました")
+        raise _too_many_requests(retry_after)
+
+    retry_after = await rate_limit_backend.acquire(
+        "global",
+        settings.rate_limit_global_rate,
+        settings.rate_limit_global_burst,
+    )
+    if retry_after > 0:
+        # 他のクライアントの負荷でユーザーのトークンが減らないよう戻す
+        await rate_limit_backend.refund(user_key, settings.rate_limit_user_burst)
+        logger.warning("全体のレート制限を超えました")
+        raise _too_many_requests(retry_after)
@@ -0,0 +1,20 @@
+import os
+import sys
+
+# core.config の必須設定をテスト用に埋める
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+for name in [
+    "SUPABASE_KEY",
+    "AWS_ACCESS_KEY",
+    "AWS_SECRET_KEY",
+    "AWS_CLOTHES_BUCKET_NAME",
+    "AWS_VTON_BUCKET_NAME",
+    "AWS_INDEX_BUCKET_NAME",
+    "AWS_BODY_BUCKET_NAME",
+    "AWS_FAISS_INDEX_NAME",
+    "INTERNAL_API_SECRET",
+    "FITDIT_URL",
+]:
+    os.environ.setdefault(name, "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,164 @@
+import numpy as np
+import pytest
+from postgrest.exceptions import APIError
+
+from core.config import settings
+from utils import catalog as catalog_module
+from utils.catalog import SNAPSHOT_FORMAT, CatalogSnapshot
+
+
+class FakeDatabase:
+    """t_clothes を辞書で持つ get_clothes_attributes のスタブ"""
+
+    def __init__(self, rows):
+        self.rows = {row["id"]: row for row in rows}
+        self.calls = []
+        self.duplicates = []
+        self.error = None
+
+    def get_clothes_attributes(self, updated_since=None, with_stamp=True):
+        self.calls.append((updated_since, with_stamp))
+        if self.error is not None:
+            raise self.error
+        rows = [dict(row) for row in self.rows.values()]
+        if with_stamp and updated_since:
+            rows = [row for row in rows if row["updated_at"] >= updated_since]
+        if not with_stamp:
+            for row in rows:
+                row.pop("updated_at")
+        return rows + self.duplicates
+
+
+def row(id_, gender, part, updated_at):
+    return {"id": id_, "gender": gender, "part": part, "updated_at": updated_at}
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    monkeypatch.setattr(settings, "catalog_updated_column", "updated_at")
+    monkeypatch.setattr(settings, "catalog_full_refresh_every", 3)
+    db = FakeDatabase([
+        row(1, "man", "Upper-body", "2026-01-01T00:00:00+00:00"),
+        row(2, "woman", "Upper-body", "2026-01-02T00:00:00+00:00"),
+        row(3, "woman", "Lower-body", "2026-01-02T00:00:00+00:00"),
+    ])
+    monkeypatch.setattr(catalog_module, "db", db)
+    return db
+
+
+@pytest.fixture
+def snapshot(tmp_path, fake_db):
+    return CatalogSnapshot(str(tmp_path / "catalog_snapshot.npz"))
+
+
+def test_incremental_refresh_merges_changed_rows(snapshot, fake_db):
+    snapshot.refresh()
+    assert fake_db.calls == [(None, True)]
+    assert snapshot.version == "2026-01-02T00:00:00+00:00"
+
+    fake_db.rows[1] = row(1, "man", "Lower-body", "2026-01-03T00:00:00+00:00")
+    fake_db.rows[4] = row(4, "man", "Upper-body", "2026-01-03T00:00:00+00:00")
+    snapshot.refresh()
+
+    assert fake_db.calls[-1] == ("2026-01-02T00:00:00+00:00", True)
+    assert snapshot.ids_by_clothes_part("Upper-body").tolist() == [2, 4]
+    assert snapshot.ids_by_clothes_part("Lower-body").tolist() == [1, 3]
+    assert snapshot.ids_by_gender("man").tolist() == [1, 4]
+
+
+def test_gte_overlap_does_not_duplicate_and_version_moves_forward(snapshot, fake_db):
+    snapshot.refresh()
+    # 同時刻の行はもう一度取得されるが、重複しない
+    assert snapshot.refresh() == 2
+    assert len(snapshot) == 3
+    assert snapshot.version == "2026-01-02T00:00:00+00:00"
+
+    fake_db.rows[3] = row(3, "woman", "Upper-body", "2026-01-05T00:00:00+00:00")
+    snapshot.refresh()
+    assert len(snapshot) == 3
+    assert snapshot.version == "2026-01-05T00:00:00+00:00"
+
+
+def test_duplicate_rows_from_paging_use_last_row(snapshot, fake_db):
+    fake_db.duplicates = [row(2, "woman", "Dressed", "2026-01-02T00:00:00+00:00")]
+    snapshot.refresh()
+
+    assert len(snapshot) == 3
+    assert snapshot.ids_by_clothes_part("Dressed").tolist() == [2]
+
+
+def test_deleted_rows_are_removed_on_full_refresh(snapshot, fake_db):
+    snapshot.refresh()
+    del fake_db.rows[2]
+
+    # 差分取得では削除を検知しない
+    snapshot.refresh()
+    snapshot.refresh()
+    assert 2 in snapshot.ids_by_gender("woman").tolist()
+
+    # catalog_full_refresh_every 回ごとの全件取得で取り除かれる
+    snapshot.refresh()
+    assert fake_db.calls[-1] == (None, True)
+    assert snapshot.ids_by_gender("woman").tolist() == [3]
+
+
+def test_snapshot_round_trip(snapshot, fake_db):
+    snapshot.refresh()
+
+    loaded = CatalogSnapshot(snapshot.path)
+    assert loaded.load()
+    assert loaded.version == snapshot.version
+    assert loaded.ids_by_clothes_part("Upper-body").tolist() == [1, 2]
+    assert loaded.ids_by_gender("woman").tolist() == [2, 3]
+
+    # 読み込んだ後は差分のみ取得する
+    loaded.refresh()
+    assert fake_db.calls[-1] == (snapshot.version, True)
+
+
+def test_snapshot_with_other_format_is_ignored(snapshot, fake_db):
+    snapshot.refresh()
+    with np.load(snapshot.path) as data:
+        arrays = dict(data)
+    arrays["format"] = np.int64(SNAPSHOT_FORMAT + 1)
+    with open(snapshot.path, "wb") as f:
+        np.savez(f, **arrays)
+
+    assert not CatalogSnapshot(snapshot.path).load()
+
+
+def test_missing_stamp_column_falls_back_to_full_fetch(snapshot, fake_db):
+    fake_db.error = APIError({"code": "42703", "message": "column t_clothes.updated_at does not exist"})
+    original = fake_db.get_clothes_attributes
+
+    def get_clothes_attributes(updated_since=None, with_stamp=True):
+        if not with_stamp:
+            fake_db.error = None
+        return original(updated_since=updated_since, with_stamp=with_stamp)
+
+    fake_db.get_clothes_attributes = get_clothes_attributes
+    snapshot.refresh()
+    assert len(snapshot) == 3
+    assert snapshot.version is None
+
+    # 列が無いことを覚えているので、失敗するクエリは再送しない
+    snapshot.refresh()
+    assert fake_db.calls[1:] == [(None, False), (None, False)]
+
+
+def test_other_errors_propagate_and_keep_data(snapshot, fake_db):
+    snapshot.refresh()
+    fake_db.error = APIError({"code": "57014", "message": "canceling statement due to statement timeout"})
+
+    with pytest.raises(APIError):
+        snapshot.refresh()
+    assert len(snapshot) == 3
+    assert fake_db.calls[-1] == (snapshot.version, True)
+
+
+def test_empty_catalog_falls_back_to_database(snapshot, fake_db):
+    fake_db.get_clothes_ids_about_clothes_part = lambda clothes_part: [5, 6]
+    fake_db.get_clothes_ids_about_gender = lambda gender: [7]
+
+    assert snapshot.ids_by_clothes_part("Upper-body").tolist() == [5, 6]
+    assert snapshot.ids_by_gender("man").tolist() == [7]
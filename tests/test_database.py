@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from utils.database import db
+
+
+class FakeQuery:
+    """order/range/execute のみを持つクエリビルダーのスタブ(サーバーの max-rows を再現する)"""
+
+    def __init__(self, table, count, max_rows, counts):
+        self.table = table
+        self.count = count
+        self.max_rows = max_rows
+        self.counts = counts
+
+    def order(self, column):
+        return self
+
+    def range(self, start, end):
+        self.start, self.end = start, end
+        return self
+
+    def execute(self):
+        self.counts.append(self.count)
+        end = min(self.end, self.start + self.max_rows - 1)
+        return SimpleNamespace(
+            data=self.table[self.start:end + 1],
+            count=len(self.table) if self.count else None,
+        )
+
+
+def fetch(n_rows, page_size, max_rows):
+    table = [{"id": i} for i in range(n_rows)]
+    counts = []
+    rows = db.fetch_all_pages(lambda count: FakeQuery(table, count, max_rows, counts), page_size=page_size)
+    return rows, counts
+
+
+def test_fetch_all_pages_counts_only_first_page():
+    rows, counts = fetch(n_rows=25, page_size=10, max_rows=10)
+
+    assert [row["id"] for row in rows] == list(range(25))
+    assert counts == ["exact", None, None]
+
+
+def test_fetch_all_pages_follows_server_max_rows():
+    # page_size がサーバーの max-rows より大きくても取りこぼさない
+    rows, counts = fetch(n_rows=25, page_size=10, max_rows=4)
+
+    assert [row["id"] for row in rows] == list(range(25))
+    assert len(counts) == 7
@@ -0,0 +1,195 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import httpx
+import numpy as np
+import pytest
+
+# main.py のモデル・インデックス・S3の依存をスタブにして読み込む
+for name in ["torch", "open_clip", "faiss", "utils.s3"]:
+    sys.modules.setdefault(name, MagicMock())
+
+import main  # noqa: E402
+from core.config import settings  # noqa: E402
+from middlewares import rate_limit  # noqa: E402
+from middlewares.rate_limit import MemoryTokenBucketBackend, RequestCoalescer  # noqa: E402
+
+USER_BURST = 2
+GLOBAL_BURST = 5
+HEADERS = {"x-internal-secret": settings.internal_api_secret}
+
+
+class SplitBackend:
+    """ユーザー別と全体のバケットを別のバックエンドで持つ(全体だけ差し替えられるようにする)"""
+
+    def __init__(self):
+        self.users = MemoryTokenBucketBackend()
+        self.global_ = MemoryTokenBucketBackend()
+
+    def _backend(self, key):
+        return self.global_ if key == "global" else self.users
+
+    async def acquire(self, key, rate, capacity):
+        return await self._backend(key).acquire(key, rate, capacity)
+
+    async def refund(self, key, capacity):
+        await self._backend(key).refund(key, capacity)
+
+
+class FakeDatabase:
+    def get_user_by_id(self, user_id):
+        return SimpleNamespace(data=[{"body_url": f"body/{user_id}.png", "gender": None}])
+
+    def get_preference_clothes_ids_by_clothes_part(self, user_id, clothes_part):
+        return [], [], [], []
+
+    def get_clothes_by_id(self, clothes_id):
+        return SimpleNamespace(data=[{"id": clothes_id, "object_key": f"clothes/{clothes_id}.png"}])
+
+    def create_vton(self, tops_id, object_key):
+        return SimpleNamespace(data=[{"id": 1}])
+
+    def create_user_vton(self, user_id, vton_id):
+        return SimpleNamespace(data=[])
+
+
+class FakeCatalog:
+    def ids_by_clothes_part(self, clothes_part):
+        return np.array([1, 2, 3], dtype=np.int64)
+
+    def ids_by_gender(self, gender):
+        return np.array([], dtype=np.int64)
+
+
+@pytest.fixture
+def fitdit_calls(monkeypatch):
+    """
+    main.app の /recommend を、DB・検索・FitDitをスタブにして呼べるようにする
+    """
+    # テスト中は補充されないようにする
+    monkeypatch.setattr(settings, "rate_limit_user_rate", 1e-6)
+    monkeypatch.setattr(settings, "rate_limit_user_burst", USER_BURST)
+    monkeypatch.setattr(settings, "rate_limit_global_rate", 1e-6)
+    monkeypatch.setattr(settings, "rate_limit_global_burst", GLOBAL_BURST)
+    monkeypatch.setattr(rate_limit, "rate_limit_backend", SplitBackend())
+    coalescer = RequestCoalescer()
+    monkeypatch.setattr(rate_limit, "recommend_coalescer", coalescer)
+    monkeypatch.setattr(main, "recommend_coalescer", coalescer)
+
+    monkeypatch.setattr(main, "db", FakeDatabase())
+    monkeypatch.setattr(main, "catalog", FakeCatalog())
+    monkeypatch.setattr(main, "get_preference_vector", lambda *args: np.zeros(4, dtype=np.float32))
+    monkeypatch.setattr(main, "retrieve_similar_images_by_vector", lambda **kwargs: [1, 2, 3])
+
+    calls = []
+
+    async def execute_fitdit(body_object_key: str, clothes_object_key: str, clothes_type: str):
+        calls.append((body_object_key, clothes_type))
+        await asyncio.sleep(0.1)
+        return {"object_key": "vton.png"}
+
+    monkeypatch.setattr(main, "execute_fitdit", execute_fitdit)
+    return calls
+
+
+def burst(bodies):
+    async def send_all():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(
+                *[client.post("/recommend", json=body, headers=HEADERS) for body in bodies]
+            )
+
+    return asyncio.run(send_all())
+
+
+def assert_rejections_have_retry_after(responses):
+    for response in responses:
+        assert response.status_code in (200, 429)
+        if response.status_code == 429:
+            assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_same_user_and_category_burst_is_coalesced(fitdit_calls):
+    responses = burst([{"user_id": "u1", "clothes_category": "Upper-body"}] * 30)
+
+    assert_rejections_have_retry_after(responses)
+    assert len(fitdit_calls) <= USER_BURST
+    # 相乗りしたリクエストも結果を受け取る
+    assert sum(r.status_code == 200 for r in responses) > len(fitdit_calls)
+
+
+def test_one_user_burst_is_bounded_by_user_bucket(fitdit_calls):
+    bodies = [{"user_id": "u1", "clothes_category": "Upper-body"}, {"user_id": "u1", "clothes_category": "Dressed"}]
+    responses = burst(bodies * 15 + [{"user_id": "u1", "clothes_category": "Lower-body"}] * 15)
+
+    assert_rejections_have_retry_after(responses)
+    assert len(fitdit_calls) <= USER_BURST
+    assert any(r.status_code == 429 for r in responses)
+
+
+def test_many_users_burst_is_bounded_by_global_bucket(fitdit_calls):
+    bodies = [{"user_id": f"u{i}", "clothes_category": "Upper-body"} for i in range(30)]
+    responses = burst(bodies)
+
+    assert_rejections_have_retry_after(responses)
+    assert len(fitdit_calls) == GLOBAL_BURST
+
+
+def test_global_rejection_refunds_user_token(fitdit_calls):
+    burst([{"user_id": f"u{i}", "clothes_category": "Upper-body"} for i in range(GLOBAL_BURST)])
+    responses = burst([{"user_id": "late", "clothes_category": "Upper-body"}])
+    assert responses[0].status_code == 429
+
+    # 全体のバケットを空きのあるものに替えると、late はユーザーの上限まで受け付けられる
+    rate_limit.rate_limit_backend.global_ = MemoryTokenBucketBackend()
+    statuses = [
+        burst([{"user_id": "late", "clothes_category": f"category-{i}"}])[0].status_code
+        for i in range(USER_BURST + 1)
+    ]
+    assert statuses == [200] * USER_BURST + [429]
+
+
+def test_invalid_user_id_is_validated_by_endpoint(fitdit_calls):
+    responses = burst([{"user_id": ["u1"], "clothes_category": "Upper-body"}])
+
+    assert responses[0].status_code == 422
+    assert fitdit_calls == []
+
+
+def test_memory_backend_evicts_refilled_buckets(monkeypatch):
+    backend = MemoryTokenBucketBackend()
+    monkeypatch.setattr(backend, "EVICT_INTERVAL", 0)
+
+    async def run():
+        await backend.acquire("user:fast", rate=1e6, capacity=1)
+        await backend.acquire("user:slow", rate=1e-6, capacity=1)
+        await asyncio.sleep(0.01)
+        await backend.acquire("global", rate=1e-6, capacity=5)
+
+    asyncio.run(run())
+    # 満タンに戻ったバケットだけが削除される
+    assert "user:fast" not in backend._buckets
+    assert "user:slow" in backend._buckets
+
+
+def test_coalescer_retrieves_exception_without_waiters(caplog):
+    coalescer = RequestCoalescer()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("fitdit failed")
+
+    async def run():
+        waiter = asyncio.ensure_future(coalescer.run("key", fail))
+        await asyncio.sleep(0)
+        # 待っていたクライアントが切断しても、共有した処理の例外はログに残る
+        waiter.cancel()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert not coalescer.in_flight("key")
+    assert "fitdit failed" in caplog.text
+    assert "never retrieved" not in caplog.text
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from middlewares.rate_limit import RedisTokenBucketBackend
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+def run_with_backend(func):
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        try:
+            return await func(RedisTokenBucketBackend(client), client)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_acquire_and_reject_with_retry_after():
+    async def scenario(backend, client):
+        results = [await backend.acquire("user:u1", rate=0.5, capacity=2) for _ in range(3)]
+        ttl = await client.ttl("rate_limit:user:u1")
+        return results, ttl
+
+    results, ttl = run_with_backend(scenario)
+    assert results[:2] == [0.0, 0.0]
+    # 空になったら次のトークンまでの秒数(1 / rate)を返す
+    assert results[2] == pytest.approx(2.0, abs=0.05)
+    assert ttl > 0
+
+
+def test_refund_returns_one_token():
+    async def scenario(backend, client):
+        await backend.acquire("user:u1", rate=1e-6, capacity=1)
+        rejected = await backend.acquire("user:u1", rate=1e-6, capacity=1)
+        await backend.refund("user:u1", capacity=1)
+        after_refund = await backend.acquire("user:u1", rate=1e-6, capacity=1)
+        return rejected, after_refund
+
+    rejected, after_refund = run_with_backend(scenario)
+    assert rejected > 0
+    assert after_refund == 0.0
+
+
+def test_refund_does_not_exceed_capacity():
+    async def scenario(backend, client):
+        await backend.acquire("user:u1", rate=1e-6, capacity=2)
+        await backend.refund("user:u1", capacity=2)
+        await backend.refund("user:u1", capacity=2)
+        return [await backend.acquire("user:u1", rate=1e-6, capacity=2) for _ in range(3)]
+
+    results = run_with_backend(scenario)
+    assert results[:2] == [0.0, 0.0]
+    assert results[2] > 0
@@ -0,0 +1,191 @@
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional
+
+import numpy as np
+from postgrest.exceptions import APIError
+
+from core.config import settings
+from utils.database import db
+
+logger = logging.getLogger(__name__)
+
+# スナップショットのフォーマットを変更した場合はインクリメントする
+SNAPSHOT_FORMAT = 1
+
+# PostgreSQLの undefined_column エラーコード
+UNDEFINED_COLUMN = "42703"
+
+
+class CatalogSnapshot:
+    """
+    洋服カタログの属性(id, gender, part)をローカルの .npz に保持するクラス
+    起動時はスナップショットを読み込み、以降はバージョン(最終更新日時)以降に
+    更新された行のみをSupabaseから取得して差分をマージする
+    削除された行は catalog_full_refresh_every 回ごとの全件取得で取り除く
+    更新日時の列が無い場合は毎回全件を取得する
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version: Optional[str] = None
+        # (ids, genders, parts) を1つのタプルで差し替えることで、読み取り側とのロックを不要にする
+        self._data = self._empty()
+        self._refresh_lock = threading.Lock()
+        self._refresh_count = 0
+        # 更新日時の列が無いと分かったら、以降は列を使わずに取得する
+        self._stamp_available = True
+
+    @staticmethod
+    def _empty():
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype="<U16"),
+            np.empty(0, dtype="<U16"),
+        )
+
+    def __len__(self) -> int:
+        return len(self._data[0])
+
+    def load(self) -> bool:
+        """
+        ローカルのスナップショットを読み込む
+        returns:
+            loaded: bool (読み込めた場合True)
+        """
+        if not os.path.exists(self.path):
+            logger.info(f"カタログスナップショットがありません: {self.path}")
+            return False
+        try:
+            with np.load(self.path) as snapshot:
+                if int(snapshot["format"]) != SNAPSHOT_FORMAT:
+                    logger.warning(f"カタログスナップショットのフォーマットが異なるため破棄します: {self.path}")
+                    return False
+                version = str(snapshot["version"])
+                self._data = (snapshot["ids"], snapshot["genders"], snapshot["parts"])
+        except Exception as e:
+            logger.warning(f"カタログスナップショットの読み込みに失敗しました: {e}")
+            return False
+        self.version = version or None
+        logger.info(f"カタログスナップショットをロードしました: {len(self)}件 (version: {self.version})")
+        return True
+
+    def save(self, data=None, version: Optional[str] = None) -> None:
+        """
+        スナップショットを一時ファイルに書き出してから置き換える
+        一時ファイルは書き込みごとに別名にし、複数ワーカーが同時に書き込んでも衝突しないようにする
+        """
+        if data is None:
+            data, version = self._data, self.version
+        ids, genders, parts = data
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    format=np.int64(SNAPSHOT_FORMAT),
+                    version=np.str_(version or ""),
+                    ids=ids,
+                    genders=genders,
+                    parts=parts,
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _fetch(self, full: bool):
+        """
+        洋服の属性を取得する
+        returns:
+            rows: list[dict]
+            stamped: bool (更新日時の列を取得できたか)
+            full: bool (全件取得したか)
+        """
+        if self._stamp_available:
+            try:
+                rows = db.get_clothes_attributes(updated_since=None if full else self.version)
+                return rows, True, full
+            except APIError as e:
+                if e.code != UNDEFINED_COLUMN:
+                    raise
+                logger.warning(
+                    f"{settings.catalog_updated_column}列が無いため、以降は毎回全件取得します: {e}"
+                )
+                self._stamp_available = False
+        return db.get_clothes_attributes(with_stamp=False), False, True
+
+    def refresh(self) -> int:
+        """
+        バージョン以降に更新された行を取得してマージする
+        バージョンが無い場合と catalog_full_refresh_every 回ごとは全件を取り直し、削除された行もそこで取り除く
+        returns:
+            changed: int (取得した行数)
+        """
+        with self._refresh_lock:
+            full = (
+                self.version is None
+                or (self._refresh_count > 0 and self._refresh_count % settings.catalog_full_refresh_every == 0)
+            )
+            self._refresh_count += 1
+            rows, stamped, full = self._fetch(full)
+
+            # ページング中の書き込みで同じ行が重複することがあるため、IDごとに最後の行を使う
+            latest = {row["id"]: row for row in rows}
+            new_ids = np.fromiter(latest.keys(), dtype=np.int64, count=len(latest))
+            new_genders = np.array([row.get("gender") or "" for row in latest.values()], dtype="<U16")
+            new_parts = np.array([row.get("part") or "" for row in latest.values()], dtype="<U16")
+
+            # 更新された行を既存データから取り除いてから追加する
+            ids, genders, parts = self._empty() if full else self._data
+            keep = ~np.isin(ids, new_ids)
+            ids = np.concatenate([ids[keep], new_ids])
+            genders = np.concatenate([genders[keep], new_genders])
+            parts = np.concatenate([parts[keep], new_parts])
+
+            order = np.argsort(ids, kind="stable")
+            data = (ids[order], genders[order], parts[order])
+
+            updated_column = settings.catalog_updated_column
+            stamps = [row[updated_column] for row in latest.values() if row.get(updated_column)] if stamped else []
+            if not stamped:
+                version = None
+            elif full:
+                version = max(stamps) if stamps else None
+            else:
+                version = max([self.version, *stamps])
+
+            unchanged = version == self.version and all(
+                np.array_equal(new, old) for new, old in zip(data, self._data)
+            )
+            if not unchanged:
+                # 書き込みに成功してからメモリ上のデータを差し替える
+                self.save(data, version)
+                self._data, self.version = data, version
+            logger.info(f"カタログを更新しました: {len(rows)}件取得, 合計{len(self)}件 (version: {self.version})")
+            return len(rows)
+
+    def ids_by_gender(self, gender: str) -> np.ndarray:
+        """性別によって洋服IDを選ぶ(カタログが未取得の場合はSupabaseから取得する)"""
+        ids, genders, _ = self._data
+        if len(ids) == 0:
+            logger.warning("カタログが空のため、Supabaseから性別別の洋服IDを取得します")
+            return np.asarray(db.get_clothes_ids_about_gender(gender=gender), dtype=np.int64)
+        return ids[genders == gender]
+
+    def ids_by_clothes_part(self, clothes_part: str) -> np.ndarray:
+        """カテゴリによって洋服IDを選ぶ(カタログが未取得の場合はSupabaseから取得する)"""
+        ids, _, parts = self._data
+        if len(ids) == 0:
+            logger.warning("カタログが空のため、Supabaseからカテゴリ別の洋服IDを取得します")
+            return np.asarray(db.get_clothes_ids_about_clothes_part(clothes_part=clothes_part), dtype=np.int64)
+        return ids[parts == clothes_part]
+
+
+# グローバルカタログインスタンス
+catalog = CatalogSnapshot(settings.local_catalog_path)
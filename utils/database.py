@@ -1,5 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-from typing import Optional
+from typing import Callable, Optional
 from core.config import settings
 
 
@@ -94,15 +95,69 @@ class Database:
             "vton_id": vton_id
         }).execute()
 
+    def fetch_all_pages(self, build_query: Callable, page_size: Optional[int] = None) -> list:
+        """
+        PostgRESTの行数上限で切り捨てられないよう、Rangeでページングして全件取得する
+        1ページ目で総件数を取得し、残りのページは並列で取得する
+        args:
+            build_query: Callable[[Optional[str]], クエリビルダー]
+                (countを受け取り、select済み・フィルタ済みのクエリを毎回新しく返す関数)
+            page_size: int
+        returns:
+            rows: list[dict]
+        """
+        page_size = page_size or settings.supabase_page_size
+        
+        # 1ページ目と総件数を取得
+        first = build_query("exact").order("id").range(0, page_size - 1).execute()
+        rows = list(first.data)
+        total = first.count if first.count is not None else len(rows)
+        if not rows or total <= len(rows):
+            return rows
+        
+        # サーバー側の max-rows が page_size より小さい場合は、実際に返ってきた件数でページングする
+        page_size = min(page_size, len(rows))
+        
+        # 残りのページを並列で取得(件数の再計算は不要)
+        def fetch_page(start: int) -> list:
+            return build_query(None).order("id").range(start, start + page_size - 1).execute().data
+        
+        starts = range(page_size, total, page_size)
+        with ThreadPoolExecutor(max_workers=settings.supabase_fetch_concurrency) as executor:
+            for page in executor.map(fetch_page, starts):
+                rows.extend(page)
+        return rows
+
     def get_clothes_ids_about_gender(self, gender: str):
         """性別によって洋服を選ぶ"""
-        result = self._client.table("t_clothes").select("id").eq("gender", gender).execute()
-        return [item["id"] for item in result.data]
+        rows = self.fetch_all_pages(
+            lambda count: self._client.table("t_clothes").select("id", count=count).eq("gender", gender)
+        )
+        return [item["id"] for item in rows]
     
     def get_clothes_ids_about_clothes_part(self, clothes_part: str):
         """カテゴリによって洋服を選ぶ"""
-        result = self._client.table("t_clothes").select("id").eq("part", clothes_part).execute()
-        return [item["id"] for item in result.data]
+        rows = self.fetch_all_pages(
+            lambda count: self._client.table("t_clothes").select("id", count=count).eq("part", clothes_part)
+        )
+        return [item["id"] for item in rows]
+    
+    def get_clothes_attributes(self, updated_since: Optional[str] = None, with_stamp: bool = True):
+        """
+        スナップショット用に洋服の属性(id, gender, part, 更新日時)を全件取得する
+        updated_since を指定した場合はそれ以降(同時刻を含む)に更新された行のみ取得する
+        with_stamp=False の場合は更新日時の列を使わずに全件取得する
+        """
+        updated_column = settings.catalog_updated_column
+        columns = f"id,gender,part,{updated_column}" if with_stamp else "id,gender,part"
+        
+        def build_query(count):
+            query = self._client.table("t_clothes").select(columns, count=count)
+            if with_stamp and updated_since:
+                query = query.gte(updated_column, updated_since)
+            return query
+        
+        return self.fetch_all_pages(build_query)
 
 # グローバルデータベースインスタンス
 db = Database()
\ No newline at end of file